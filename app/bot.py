@@ -1,31 +1,49 @@
+import time
+_started_at = time.perf_counter()
+
 import asyncio
 import os
-from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
 
 from .handlers import home, moderator, administrator
-from core.db import init_db
+from core.db import init_db, engine, read_engine
 from core.scheduler import init_scheduler, scheduler
-from core.middlewares import setup_middlewares
+from core.middlewares import setup_middlewares, setup_router_throttling
+from core.tracing import TracingRequestMiddleware, instrument_engine
+from core.logger import logger
+from core.shutdown import shutdown
+
+
+class StartupTimer:
+    """Замер длительности этапов запуска."""
+    def __init__(self, started_at: float):
+        self.phases = []
+        self._started_at = started_at
+        self._last = started_at
 
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        phases = ", ".join(f"{phase}={duration * 1000:.0f}ms" for phase, duration in self.phases)
+        logger.info(f"Запуск за {(self._last - self._started_at) * 1000:.0f}ms: {phases}")
 
-load_dotenv()
 
 async def on_startup(bot: Bot):
     """Функция инициализации при старте"""
     await init_scheduler(bot)
 
-async def init_scheduler(bot: Bot):
-    """Инициализация планировщика с ботом"""
-    scheduler._bot = bot
-    if not scheduler.running:
-        scheduler.start()
-
 
 # Запуск бота
 async def main():
+    timer = StartupTimer(_started_at)
+    timer.mark("imports")
+
     # 1. Инициализация БД
     await init_db()
+    timer.mark("init_db")
     
     # 2. Создает экземпляры бота и диспетчера
     bot = Bot(token=os.environ.get("TG_TOKEN"))
@@ -33,20 +51,37 @@ async def main():
 
     # 3. Инициализация
     setup_middlewares(dp)
+    instrument_engine(engine)
+    if read_engine is not None:
+        instrument_engine(read_engine)
+    bot.session.middleware(TracingRequestMiddleware())
+    timer.mark("dispatcher")
     await on_startup(bot)
+    timer.mark("scheduler")
     
     # 4. Роутеры
     dp.include_router(home.router)
     dp.include_router(moderator.router)
     dp.include_router(administrator.router)
+    # Команды администратора (выгрузки, массовые операции) тяжелее обычных
+    setup_router_throttling(administrator.router, rate=0.2, burst=3.0)
+    timer.mark("routers")
+    timer.report()
     
     # 5. Запуск бота
+    # 6. Остановка: по SIGTERM/SIGINT aiogram прекращает получать апдейты,
+    # после чего активные рассылки дорабатывают до дедлайна и сохраняют позицию.
+    # Сессию бота закрываем сами после drain, иначе отправки рассылок оборвутся
     try:
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, close_bot_session=False)
     finally:
-        scheduler.shutdown()
+        if scheduler.running:
+            scheduler.pause()
+        await shutdown.drain()
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
         await bot.session.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+"""
+Разбор и проверка контента рассылки до отправки.
+За один проход по тексту извлекает кнопки, проверяет HTML-разметку и лимиты Telegram
+и при необходимости делит длинный текст на несколько сообщений.
+"""
+import re
+
+
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+CALLBACK_DATA_LIMIT = 64
+BUTTONS_LIMIT = 100
+# Действия кнопок с этими префиксами - ссылки, остальные отправляются как callback_data
+URL_SCHEMES = ("http://", "https://", "tg://")
+
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "a", "code", "pre", "span", "tg-spoiler", "tg-emoji", "blockquote",
+}
+NAMED_ENTITIES = {"lt", "gt", "amp", "quot"}
+BUTTONS_SEPARATOR = re.compile(r'\n?^-{3}\s*$\n?', re.MULTILINE)
+
+_TOKEN_RE = re.compile(
+    r'\[(?P<btn_text>[^\]]+)\]\((?P<btn_url>[^)]+)\)'
+    r'|<(?P<close>/?)(?P<tag>[a-zA-Z][\w-]*)(?P<attrs>[^<>]*)>'
+    r'|&(?P<entity>#\d+|#x[0-9a-fA-F]+|[a-zA-Z]+);'
+    r'|(?P<special>[<>&])'
+)
+_ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+
+
+def visible_length(text: str) -> int:
+    """Длина в единицах UTF-16, как ее считает Telegram."""
+    return len(text.encode("utf-16-le")) // 2
+
+def compile_content(raw: str, limit: int = TEXT_LIMIT, split: bool = True):
+    """
+        Компилирует текст или подпись рассылки.
+        Кнопки задаются как [Текст](URL) в тексте или строками "Текст | действие" после "---".
+        Одиночные <, > и & экранируются. Если split=False, текст длиннее limit считается ошибкой.
+        Возвращает (части текста, кнопки, ошибки).
+    """
+    parts = BUTTONS_SEPARATOR.split(raw, maxsplit=1)
+    body = parts[0]
+    buttons = []
+    errors = []
+
+    tokens = []
+    stack = []
+    pos = 0
+    for match in _TOKEN_RE.finditer(body):
+        if match.start() > pos:
+            tokens.append(("text", body[pos:match.start()]))
+        pos = match.end()
+
+        if match.group("btn_text"):
+            buttons.append((match.group("btn_text").strip(), match.group("btn_url").strip()))
+        elif match.group("tag"):
+            name = match.group("tag").lower()
+            if name not in ALLOWED_TAGS:
+                errors.append(f"Неподдерживаемый тег <{name}>")
+            elif match.group("close"):
+                if not stack or stack[-1][0] != name:
+                    errors.append(f"Лишний или неверно вложенный закрывающий тег </{name}>")
+                else:
+                    stack.pop()
+                    tokens.append(("close", match.group(0)))
+            else:
+                if name == "a" and "href" not in match.group("attrs"):
+                    errors.append("У ссылки <a> нет атрибута href")
+                stack.append((name, match.group(0)))
+                tokens.append(("open", match.group(0)))
+        elif match.group("entity"):
+            entity = match.group("entity")
+            if not entity.startswith("#") and entity.lower() not in NAMED_ENTITIES:
+                tokens.append(("entity", "&amp;" + entity + ";", visible_length(entity) + 2))
+            else:
+                tokens.append(("entity", match.group(0), 1))
+        else:
+            tokens.append(("entity", _ESCAPES[match.group("special")], 1))
+    if pos < len(body):
+        tokens.append(("text", body[pos:]))
+    for name, _ in stack:
+        errors.append(f"Тег <{name}> не закрыт")
+
+    if len(parts) > 1:
+        for line in parts[1].split("\n"):
+            if " | " in line:
+                btn_text, btn_action = line.split(" | ", 1)
+                buttons.append((btn_text.strip(), btn_action.strip()))
+            elif line.strip():
+                errors.append(f"Строка кнопки без разделителя \" | \": {line.strip()}")
+    errors += validate_buttons(buttons)
+
+    chunks = split_tokens(tokens, limit)
+    if not split and len(chunks) > 1:
+        errors.append(f"Текст длиннее {limit} символов")
+    return chunks, buttons, errors
+
+def validate_buttons(buttons) -> list:
+    errors = []
+    if len(buttons) > BUTTONS_LIMIT:
+        errors.append(f"Кнопок больше {BUTTONS_LIMIT}")
+    for text, action in buttons:
+        if not text:
+            errors.append(f"Пустой текст кнопки для {action}")
+        if action.startswith(URL_SCHEMES):
+            continue
+        size = len(action.encode("utf-8"))
+        if not 1 <= size <= CALLBACK_DATA_LIMIT:
+            errors.append(f"callback_data кнопки \"{text}\" занимает {size} байт (максимум {CALLBACK_DATA_LIMIT})")
+    return errors
+
+def split_tokens(tokens, limit: int) -> list:
+    """
+        Собирает токены в части не длиннее limit видимых символов.
+        Текст режется по строкам, а если строка не помещается - по словам или символам.
+        Открытые теги закрываются в конце части и открываются заново в следующей.
+    """
+    chunks = []
+    current = []
+    length = 0
+    stack = []
+
+    def flush():
+        nonlocal current, length
+        text = "".join(current + [_closing(tag) for tag in reversed(stack)]).strip()
+        if re.sub(r'<[^>]*>', '', text).strip():
+            chunks.append(text)
+        current = list(stack)
+        length = 0
+
+    for token in tokens:
+        if token[0] == "open":
+            stack.append(token[1])
+            current.append(token[1])
+            continue
+        if token[0] == "close":
+            stack.pop()
+            current.append(token[1])
+            continue
+        if token[0] == "entity":
+            if length + token[2] > limit:
+                flush()
+            current.append(token[1])
+            length += token[2]
+            continue
+
+        for piece in re.split(r'(?<=\n)', token[1]):
+            while piece:
+                room = limit - length
+                size = visible_length(piece)
+                if size <= room:
+                    current.append(piece)
+                    length += size
+                    break
+                if length and size <= limit:
+                    flush()
+                    continue
+                head = _cut(piece, room)
+                if not head:
+                    flush()
+                    continue
+                current.append(head)
+                length += visible_length(head)
+                piece = piece[len(head):]
+                flush()
+    flush()
+    return chunks
+
+def _cut(text: str, room: int) -> str:
+    """Начало text не длиннее room, по возможности обрезанное по пробелу."""
+    head = text[:room]
+    while visible_length(head) > room:
+        head = head[:-1]
+    if len(head) < len(text):
+        space = head.rfind(" ")
+        if space > 0:
+            head = head[:space + 1]
+    return head
+
+def _closing(open_tag: str) -> str:
+    return "</" + re.match(r'<([a-zA-Z][\w-]*)', open_tag).group(1) + ">"
@@ -1,10 +1,16 @@
-from sqlalchemy import select, update
-from functools import wraps
+from datetime import timedelta
+from sqlalchemy import select, update, delete, insert, values, column, cast, func, tuple_, BigInteger
 
-from .models import User, UserRole, Broadcast
+from .models import User, UserRole, Broadcast, BroadcastArchive, StatusBroadcast, RecurringBroadcast
+from core.db import reads, writes
 from core.logger import logger
 
 
+# Отставание границы инкрементальной аудитории от текущего времени, с запасом
+# больше самой долгой транзакции регистрации (см. get_registration_mark)
+REGISTRATION_MARK_LAG_SECONDS = 60
+
+
 class UserRepository:
     async def create_user_or_return(self, user_id: int, username: str, session) -> User:
         result = await session.execute(select(User).where(User.id == user_id))
@@ -17,15 +23,102 @@ class UserRepository:
         await session.commit()
         return user
 
+    @reads
     async def get_users(self, session):
         result = await session.execute(select(User))
         return result.scalars().all()
 
+    @reads
+    async def iter_user_rows(self, session, chunk_size: int = 1000, after_id: int = None):
+        """
+            Потоково отдает строки таблицы пользователей пачками по chunk_size.
+            Используется keyset-пагинация по id, поэтому в памяти не больше одной пачки.
+            after_id - продолжить с пользователей, чей id больше указанного.
+        """
+        table = User.__table__
+        last_id = after_id
+        while True:
+            query = select(table).order_by(table.c.id).limit(chunk_size)
+            if last_id is not None:
+                query = query.where(table.c.id > last_id)
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
+
+    async def get_registration_mark(self, session, lag_seconds: int = REGISTRATION_MARK_LAG_SECONDS):
+        """
+            Граница (registered_at, id) последнего пользователя, зарегистрированного
+            не позже чем lag_seconds назад, или None.
+            registered_at - время начала транзакции регистрации, а не ее фиксации: запись,
+            зафиксированная после чтения границы, может оказаться ниже нее и навсегда выпасть
+            из инкрементальной аудитории. Поэтому граница отстает от now() на lag_seconds, и
+            пропуск невозможен, пока транзакция регистрации длится меньше lag_seconds.
+            Читается из основной БД, чтобы отставание реплики не сдвигало границу.
+        """
+        result = await session.execute(
+            select(User.registered_at, User.id)
+            .where(User.registered_at <= func.now() - timedelta(seconds=lag_seconds))
+            .order_by(User.registered_at.desc(), User.id.desc())
+            .limit(1)
+        )
+        row = result.first()
+        return tuple(row) if row else None
+
+    @reads
+    async def iter_registered_users(self, session, after: tuple = None, upto: tuple = None, chunk_size: int = 1000):
+        """
+            Пачки пользователей, зарегистрированных в интервале (after, upto] по ключу
+            (registered_at, id). Keyset-пагинация по индексу, стоимость - O(новых пользователей).
+        """
+        key = tuple_(User.registered_at, User.id)
+        while True:
+            query = select(User.id, User.registered_at).order_by(User.registered_at, User.id).limit(chunk_size)
+            if after is not None:
+                query = query.where(key > tuple_(*after))
+            if upto is not None:
+                query = query.where(key <= tuple_(*upto))
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1].registered_at, rows[-1].id)
+
+    @reads
+    async def get_users_page(self, session, cursor: int = 0, backward: bool = False, role: str = None, limit: int = 10):
+        """
+            Страница пользователей по keyset-курсору.
+            backward=False - пользователи с id > cursor, backward=True - с id < cursor.
+            С фильтром по роли страница читается по индексу (role, id), а не перебором всей таблицы.
+            Возвращает (пользователи по возрастанию id, есть ли еще записи в этом направлении).
+        """
+        query = select(User).limit(limit + 1)
+        order = [User.id]
+        if role is not None:
+            query = query.where(User.role == UserRole(role))
+            order = [User.role, User.id]
+        if backward:
+            query = query.where(User.id < cursor).order_by(*(col.desc() for col in order))
+        else:
+            query = query.where(User.id > cursor).order_by(*order)
+
+        users = list((await session.execute(query)).scalars().all())
+        has_more = len(users) > limit
+        users = users[:limit]
+        if backward:
+            users.reverse()
+        return users, has_more
+
+    # Без @reads: проверка прав всегда читает основную БД. Закрепление за основной БД
+    # действует для автора записи, а не для пользователя, чью роль сменили,
+    # поэтому реплика могла бы вернуть устаревшую роль после /give_role и /bulk_roles
     async def get_user_role(self, user_id: int, session) -> str:
         result = await session.execute(select(User).where(User.id == user_id))
         user = result.scalar_one_or_none()
         return UserRole.USER.value if user is None else user.role.value
 
+    @writes
     async def update_user_role(self, user_id: int, role: str, session):
         try:
             # Проверяем, существует ли пользователь
@@ -46,7 +139,37 @@ class UserRepository:
             logger.error(f"Unexpected error updating role: {str(e)}")
             raise
 
+    @writes
+    async def bulk_update_roles(self, roles: dict[int, UserRole], session, chunk_size: int = 5000) -> set[int]:
+        """
+            Массовая смена ролей одним UPDATE ... FROM (VALUES ...) на пачку в одной транзакции.
+            Возвращает id пользователей, которые были обновлены.
+        """
+        updated = set()
+        items = list(roles.items())
+        try:
+            for i in range(0, len(items), chunk_size):
+                data = values(
+                    column("id", BigInteger),
+                    column("role", User.role.type),
+                    name="new_roles",
+                ).data(items[i:i + chunk_size])
+                result = await session.execute(
+                    update(User)
+                    .where(User.id == data.c.id)
+                    .values(role=cast(data.c.role, User.role.type))
+                    .returning(User.id)
+                )
+                updated.update(result.scalars().all())
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Unexpected error in bulk role update: {str(e)}")
+            raise
+        return updated
+
 class BroadcastRepository:
+    @writes
     async def save_schedule(self, user_id: int, data, scheduled_time, status, session):
         broadcast = Broadcast(
             created_by=user_id,
@@ -59,13 +182,176 @@ class BroadcastRepository:
 
         return broadcast
     
-    async def get_broadcasts(self, session):
-        result = await session.execute(select(Broadcast))
+    @reads
+    async def iter_due_broadcasts(self, now, session, chunk_size: int = 100):
+        """
+            Пачки (id, scheduled_time) ожидающих рассылок, время которых уже наступило
+            (в том числе прерванных). Keyset-пагинация по индексу (status, scheduled_time).
+        """
+        key = tuple_(Broadcast.scheduled_time, Broadcast.id)
+        after = None
+        while True:
+            query = (
+                select(Broadcast.id, Broadcast.scheduled_time)
+                .where(
+                    Broadcast.status == StatusBroadcast.PENDING,
+                    Broadcast.scheduled_time <= now
+                )
+                .order_by(Broadcast.scheduled_time, Broadcast.id)
+                .limit(chunk_size)
+            )
+            if after is not None:
+                query = query.where(key > tuple_(*after))
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1].scheduled_time, rows[-1].id)
+
+    @writes
+    async def expire_stale_broadcasts(self, older_than, session) -> int:
+        """
+            Помечает FAILED ожидающие рассылки со временем раньше older_than, которые
+            ни разу не начинали отправку (в stats нет позиции "resume_after").
+            Прерванные рассылки не трогает. Возвращает число помеченных.
+        """
+        result = await session.execute(
+            select(Broadcast.id, Broadcast.stats)
+            .where(
+                Broadcast.status == StatusBroadcast.PENDING,
+                Broadcast.scheduled_time < older_than
+            )
+        )
+        stale = [row.id for row in result.all() if not (row.stats and "resume_after" in row.stats)]
+        for i in range(0, len(stale), 1000):
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id.in_(stale[i:i + 1000]))
+                .values(status=StatusBroadcast.FAILED, stats={"expired": True})
+            )
+        await session.commit()
+        return len(stale)
+
+    @reads
+    async def get_broadcasts_page(self, status: StatusBroadcast, session, cursor: tuple = None, backward: bool = False, limit: int = 10):
+        """
+            Страница рассылок со статусом status по keyset-курсору (scheduled_time, id),
+            использует индекс (status, scheduled_time).
+            Возвращает (рассылки по возрастанию времени, есть ли еще записи в этом направлении).
+        """
+        key = tuple_(Broadcast.scheduled_time, Broadcast.id)
+        query = select(Broadcast).where(Broadcast.status == status).limit(limit + 1)
+        if backward:
+            query = query.order_by(Broadcast.scheduled_time.desc(), Broadcast.id.desc())
+            if cursor is not None:
+                query = query.where(key < tuple_(*cursor))
+        else:
+            query = query.order_by(Broadcast.scheduled_time, Broadcast.id)
+            if cursor is not None:
+                query = query.where(key > tuple_(*cursor))
+
+        broadcasts = list((await session.execute(query)).scalars().all())
+        has_more = len(broadcasts) > limit
+        broadcasts = broadcasts[:limit]
+        if backward:
+            broadcasts.reverse()
+        return broadcasts, has_more
+
+    @reads
+    async def count_by_status(self, session) -> dict:
+        result = await session.execute(
+            select(Broadcast.status, func.count())
+            .group_by(Broadcast.status)
+        )
+        return {status.value: count for status, count in result.all()}
+
+    @writes
+    async def save_progress(self, broadcast_id: int, stats: dict, session):
+        """Сохраняет позицию рассылки отдельным UPDATE, не загружая ее в сессию."""
+        await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(stats=stats)
+        )
+        await session.commit()
+
+    @writes
+    async def archive_broadcasts(self, older_than, session) -> int:
+        """
+            Переносит отправленные и неудачные рассылки старше older_than в архив
+            одним запросом (DELETE ... RETURNING внутри INSERT). Возвращает число перенесенных.
+        """
+        table = Broadcast.__table__
+        moved = (
+            delete(Broadcast)
+            .where(
+                Broadcast.status.in_([StatusBroadcast.SENT, StatusBroadcast.FAILED]),
+                Broadcast.scheduled_time < older_than
+            )
+            .returning(*table.c)
+            .cte("moved")
+        )
+        columns = [col.name for col in table.c]
+        result = await session.execute(
+            insert(BroadcastArchive)
+            .from_select(columns, select(*[moved.c[name] for name in columns]))
+        )
+        archived = result.rowcount
+        await session.commit()
+        return archived
+
+class RecurringBroadcastRepository:
+    @writes
+    async def save(self, user_id: int, data, trigger: str, trigger_args: dict, audience: str, mark, session):
+        recurring = RecurringBroadcast(
+            created_by=user_id,
+            content=data,
+            trigger=trigger,
+            trigger_args=trigger_args,
+            audience=audience,
+            last_registered_at=mark[0] if mark else None,
+            last_user_id=mark[1] if mark else None
+        )
+        session.add(recurring)
+        await session.commit()
+
+        return recurring
+
+    @reads
+    async def get_active(self, session):
+        result = await session.execute(
+            select(RecurringBroadcast)
+            .where(RecurringBroadcast.active.is_(True))
+            .order_by(RecurringBroadcast.id)
+        )
         return result.scalars().all()
-    
-    async def get_pending_broadcasts(self, session):
+
+    @writes
+    async def save_run(self, recurring: RecurringBroadcast, mark, run_at, stats: dict, session):
+        """Сохраняет итоги запуска и сдвигает границу аудитории."""
+        if mark is not None:
+            recurring.last_registered_at, recurring.last_user_id = mark
+        recurring.last_run_at = run_at
+        recurring.stats = stats
+        await session.commit()
+
+    @writes
+    async def save_progress(self, recurring_id: int, stats: dict, session):
+        """Сохраняет позицию текущего запуска отдельным UPDATE."""
+        await session.execute(
+            update(RecurringBroadcast)
+            .where(RecurringBroadcast.id == recurring_id)
+            .values(stats=stats)
+        )
+        await session.commit()
+
+    @writes
+    async def deactivate(self, recurring_id: int, session) -> bool:
         result = await session.execute(
-            select(Broadcast)
-            .where(Broadcast.status=="PENDING")
+            update(RecurringBroadcast)
+            .where(RecurringBroadcast.id == recurring_id)
+            .values(active=False)
+            .returning(RecurringBroadcast.id)
         )
-        return result.scalars().all()
\ No newline at end of file
+        await session.commit()
+        return result.scalar_one_or_none() is not None
@@ -1,14 +1,19 @@
-from aiogram import Router, F
+import os
+import tempfile
+from datetime import datetime, timedelta
+from aiogram import Router, F, Bot
 from aiogram.filters import Command
-from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery
+from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, FSInputFile
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 
 from ..database import UserRepository, BroadcastRepository
+from ..models import StatusBroadcast, UserRole
 from core.logger import logger
 from core.db import async_session
-from ..services import parse_users_for_admin, parse_pending_brodcasts_for_admin
-from core.keyboards import get_roles_keyboard
+from ..services import parse_users_for_admin, format_broadcasts_page, export_users_to_csv, format_users_page, parse_roles_file
+from core.keyboards import get_roles_keyboard, get_users_page_keyboard, get_broadcasts_page_keyboard
 from core.filters import IsAdminFilter
 
 
@@ -20,6 +25,9 @@ broadcast_repo = BroadcastRepository()
 class RoleStates(StatesGroup):
     waiting_for_user_id = State()
     waiting_for_role_selection = State()
+    waiting_for_roles_file = State()
+
+MAX_ROLES_FILE_SIZE = 5 * 1024 * 1024
 
 @router.message(Command("all_users"), IsAdminFilter())
 async def get_all_users(message: Message, session):
@@ -32,17 +40,121 @@ async def get_all_users(message: Message, session):
         result
     )
 
+async def edit_page(callback: CallbackQuery, text: str, keyboard):
+    """Обновляет страницу списка. Повторное нажатие той же кнопки не меняет сообщение - это не ошибка."""
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in e.message:
+            raise
+
+async def render_broadcasts_page(session, status: str = "pending", cursor: tuple = None, backward: bool = False):
+    """Текст и клавиатура страницы рассылок."""
+    counts = await broadcast_repo.count_by_status(session)
+    broadcasts, has_more = await broadcast_repo.get_broadcasts_page(
+        StatusBroadcast(status),
+        session,
+        cursor=cursor,
+        backward=backward
+    )
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    return (
+        format_broadcasts_page(counts, status, broadcasts),
+        get_broadcasts_page_keyboard(
+            status,
+            broadcasts[0] if broadcasts else None,
+            broadcasts[-1] if broadcasts else None,
+            has_prev and bool(broadcasts),
+            has_next and bool(broadcasts)
+        )
+    )
+
 @router.message(Command("all_broadcasts"), IsAdminFilter())
 async def get_all_broadcasts(message: Message, session):
-    """Просмотр запланированных рассылок."""
-    list_of_broadcasts = await parse_pending_brodcasts_for_admin(broadcast_repo, session)
-    result = ""
-    for value in list_of_broadcasts.values():
-        result += f"Модератор: {value[0]} | Запланированное время: {value[1]}\n"
-    await message.answer(
-        result
+    """Просмотр рассылок по статусам с постраничной навигацией."""
+    text, keyboard = await render_broadcasts_page(session)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("bc:"), IsAdminFilter())
+async def process_broadcasts_page(callback: CallbackQuery, session):
+    parts = callback.data.split(":", 4)
+    try:
+        status, direction = parts[1], parts[2]
+        StatusBroadcast(status)
+        cursor = (datetime.fromisoformat(parts[4]), int(parts[3])) if len(parts) == 5 else None
+    except (IndexError, ValueError):
+        await callback.answer("❌ Некорректная кнопка", show_alert=True)
+        return
+    text, keyboard = await render_broadcasts_page(session, status, cursor, direction == "p")
+    await edit_page(callback, text, keyboard)
+    await callback.answer()
+
+@router.message(Command("archive_broadcasts"), IsAdminFilter())
+async def archive_broadcasts(message: Message, session):
+    """Перенос отправленных рассылок старше суток в архив."""
+    archived = await broadcast_repo.archive_broadcasts(datetime.now() - timedelta(days=1), session)
+    await message.answer(f"📦 Перенесено в архив: {archived}")
+
+@router.message(Command("export_users"), IsAdminFilter())
+async def export_users(message: Message, session):
+    """Выгрузка всех пользователей в gzip CSV."""
+    fd, path = tempfile.mkstemp(suffix=".csv.gz")
+    os.close(fd)
+    try:
+        total = await export_users_to_csv(user_repo, session, path)
+        await message.answer_document(
+            FSInputFile(path, filename="users.csv.gz"),
+            caption=f"Пользователей: {total}"
+        )
+    except Exception as e:
+        logger.error(f"Export error: {str(e)}")
+        await message.answer("❌ Ошибка при выгрузке пользователей")
+    finally:
+        os.remove(path)
+
+async def render_users_page(session, role: str = "all", cursor: int = 0, backward: bool = False):
+    """Текст и клавиатура страницы пользователей."""
+    users, has_more = await user_repo.get_users_page(
+        session,
+        cursor=cursor,
+        backward=backward,
+        role=None if role == "all" else role
+    )
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor > 0, has_more
+    first_id = users[0].id if users else cursor
+    last_id = users[-1].id if users else cursor
+    return (
+        format_users_page(users),
+        get_users_page_keyboard(role, first_id, last_id, has_prev and bool(users), has_next and bool(users))
     )
 
+@router.message(Command("users"), IsAdminFilter())
+async def browse_users(message: Message, session):
+    """Постраничный просмотр пользователей."""
+    text, keyboard = await render_users_page(session)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("users:"), IsAdminFilter())
+async def process_users_page(callback: CallbackQuery, session):
+    parts = callback.data.split(":")
+    if (
+        len(parts) != 4
+        or parts[1] not in {"all"} | {role.value for role in UserRole}
+        or not parts[3].isdigit()
+    ):
+        await callback.answer("❌ Некорректная кнопка", show_alert=True)
+        return
+    _, role, direction, cursor = parts
+    text, keyboard = await render_users_page(session, role, int(cursor), direction == "p")
+    await edit_page(callback, text, keyboard)
+    await callback.answer()
+
 @router.message(Command("give_role"), IsAdminFilter())
 async def give_user_role(message: Message, state: FSMContext):
     await message.answer(
@@ -86,3 +198,50 @@ async def process_role_selection(callback: CallbackQuery, state: FSMContext, ses
     
     await state.clear()
 
+@router.message(Command("bulk_roles"), IsAdminFilter())
+async def bulk_roles(message: Message, state: FSMContext):
+    await message.answer(
+        "Отправьте CSV или текстовый файл со строками вида:\n"
+        "user_id,role\n"
+        "123456789,moderator",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    await state.set_state(RoleStates.waiting_for_roles_file)
+
+@router.message(RoleStates.waiting_for_roles_file, F.document, IsAdminFilter())
+async def process_roles_file(message: Message, state: FSMContext, bot: Bot, session):
+    """Применяет роли из файла одной транзакцией и возвращает сводку."""
+    if message.document.file_size and message.document.file_size > MAX_ROLES_FILE_SIZE:
+        await message.answer("❌ Файл слишком большой")
+        return
+
+    try:
+        file = await bot.download(message.document)
+        roles, invalid = parse_roles_file(file.read().decode("utf-8-sig"))
+    except UnicodeDecodeError:
+        await message.answer("❌ Файл должен быть в кодировке UTF-8")
+        return
+
+    try:
+        updated = await user_repo.bulk_update_roles(roles, session) if roles else set()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при изменении ролей: {str(e)}")
+        await state.clear()
+        return
+
+    missing = [user_id for user_id in roles if user_id not in updated]
+    result = (
+        f"✅ Обновлено: {len(updated)}\n"
+        f"🔍 Не найдено: {len(missing)}\n"
+        f"⚠️ Некорректных строк: {len(invalid)}"
+    )
+    if missing:
+        result += "\n\nНе найдены: " + ", ".join(map(str, missing[:20]))
+        if len(missing) > 20:
+            result += " ..."
+    if invalid:
+        result += "\n\nОшибки в строках: " + ", ".join(str(number) for number, _ in invalid[:20])
+        if len(invalid) > 20:
+            result += " ..."
+    await message.answer(result)
+    await state.clear()
@@ -1,3 +1,4 @@
+import asyncio
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
@@ -6,10 +7,13 @@ from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 
 from ..database import UserRepository, BroadcastRepository
-from ..services import extract_buttons_from_text, ask_confirmation, safe_edit_message, execute_broadcast
-from core.keyboards import get_schedule_keyboard
+from ..services import ask_confirmation, safe_edit_message, render_copy_source
+from ..models import StatusBroadcast
+from ..content import compile_content, TEXT_LIMIT, CAPTION_LIMIT
+from core.keyboards import get_schedule_keyboard, get_recurrence_keyboard, get_audience_keyboard, get_recurring_list_keyboard
 from core.filters import IsModeratorFilter
-from core.scheduler import save_and_schedule_broadcast
+from core.scheduler import save_and_schedule_broadcast, save_and_schedule_recurring, stop_recurring, build_trigger, recurring_repo, execute_scheduled_broadcast
+from core.shutdown import shutdown
 from core.logger import logger
 from core.db import async_session
 
@@ -18,12 +22,25 @@ router = Router()
 user_repo = UserRepository()
 broadcast_repo = BroadcastRepository()
 
+# Сколько ждать остальные сообщения альбома после первого
+ALBUM_WAIT_SECONDS = 1.0
+_album_messages: dict[str, list[int]] = {}
+
 # Состояния FSM
 class BroadcastStates(StatesGroup):
     waiting_for_content = State()
     waiting_for_confirmation = State()
     waiting_for_schedule_time = State()
     waiting_for_custom_time = State()
+    waiting_for_recurrence = State()
+    waiting_for_cron = State()
+    waiting_for_audience = State()
+
+RECURRENCE_PRESETS = {
+    "1h": {"hours": 1},
+    "1d": {"days": 1},
+    "1w": {"weeks": 1},
+}
 
 @router.message(Command("broadcast"), IsModeratorFilter())
 async def start_broadcast(message: Message, state: FSMContext):
@@ -42,27 +59,53 @@ async def start_broadcast(message: Message, state: FSMContext):
     )
     await state.set_state(BroadcastStates.waiting_for_content)
 
+async def reject_content(message: Message, errors: list):
+    """Сообщает модератору, почему рассылка не может быть отправлена."""
+    text = "❌ Рассылка не принята:\n" + "\n".join(f"- {error}" for error in errors[:20])
+    if len(errors) > 20:
+        text += f"\n... и еще {len(errors) - 20}"
+    await message.answer(text + "\n\nИсправьте сообщение и отправьте его снова.")
+
 @router.message(BroadcastStates.waiting_for_content, F.content_type == "text")
 async def process_text_broadcast(message: Message, state: FSMContext):
-    """Принимает текстовое сообщение, извлекает кнопки и сохраняет данные для рассылки."""
-    parts = message.text.split('\n---\n')
-    text_part = parts[0]
-    
-    buttons_in_text, clean_text = extract_buttons_from_text(text_part)
-    
-    additional_buttons = []
-    if len(parts) > 1:
-        for line in parts[1].split('\n'):
-            if ' | ' in line:
-                btn_text, btn_action = line.split(' | ', 1)
-                additional_buttons.append((btn_text.strip(), btn_action.strip()))
-    
-    all_buttons = buttons_in_text + additional_buttons
+    """
+        Принимает текстовое сообщение, извлекает кнопки и сохраняет данные для рассылки.
+        Текст длиннее лимита Telegram делится на несколько сообщений.
+    """
+    chunks, buttons, errors = compile_content(message.text, limit=TEXT_LIMIT)
+    if not chunks:
+        errors.append("Пустой текст рассылки")
+    if errors:
+        await reject_content(message, errors)
+        return
     
     await state.update_data(
         content_type="text",
-        text=clean_text,
-        buttons=all_buttons
+        chunks=chunks,
+        buttons=buttons,
+        source_chat_id=message.chat.id,
+        # Заполняется при создании рассылки (render_copy_source)
+        source_message_ids=None
+    )
+    await ask_confirmation(message, state)
+
+@router.message(BroadcastStates.waiting_for_content, F.media_group_id)
+async def process_album_broadcast(message: Message, state: FSMContext):
+    """Собирает сообщения альбома и сохраняет их для рассылки через copyMessages."""
+    album = _album_messages.get(message.media_group_id)
+    if album is not None:
+        album.append(message.message_id)
+        return
+
+    _album_messages[message.media_group_id] = [message.message_id]
+    await asyncio.sleep(ALBUM_WAIT_SECONDS)
+    message_ids = sorted(_album_messages.pop(message.media_group_id))
+
+    await state.update_data(
+        content_type="copy",
+        buttons=[],
+        source_chat_id=message.chat.id,
+        source_message_ids=message_ids
     )
     await ask_confirmation(message, state)
 
@@ -76,37 +119,51 @@ async def process_media_broadcast(message: Message, state: FSMContext):
     else:
         file_id = message.animation.file_id
     
-    caption = message.caption or ""
-    buttons_in_caption, clean_caption = extract_buttons_from_text(caption)
-    
-    additional_buttons = []
-    if '---' in caption:
-        caption_parts = caption.split('---')
-        clean_caption = caption_parts[0]
-        if len(caption_parts) > 1:
-            for line in caption_parts[1].split('\n'):
-                if ' | ' in line:
-                    btn_text, btn_action = line.split(' | ', 1)
-                    additional_buttons.append((btn_text.strip(), btn_action.strip()))
-    
-    all_buttons = buttons_in_caption + additional_buttons
+    chunks, buttons, errors = compile_content(message.caption or "", limit=CAPTION_LIMIT, split=False)
+    if errors:
+        await reject_content(message, errors)
+        return
     
     await state.update_data(
         content_type=message.content_type,
         file_id=file_id,
-        caption=clean_caption,
-        buttons=all_buttons
+        caption=chunks[0] if chunks else "",
+        buttons=buttons,
+        source_chat_id=message.chat.id,
+        # Заполняется при создании рассылки (render_copy_source)
+        source_message_ids=None
+    )
+    await ask_confirmation(message, state)
+
+@router.message(BroadcastStates.waiting_for_content)
+async def process_copy_broadcast(message: Message, state: FSMContext):
+    """Документы, голосовые, опросы и любой другой контент рассылаются копированием как есть."""
+    await state.update_data(
+        content_type="copy",
+        buttons=[],
+        source_chat_id=message.chat.id,
+        source_message_ids=[message.message_id]
     )
     await ask_confirmation(message, state)
 
 @router.callback_query(BroadcastStates.waiting_for_confirmation, F.data == "broadcast_confirm")
 async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot, session):
-    data = await state.get_data()
-    users = await user_repo.get_users(session)
+    """
+        Немедленная рассылка сохраняется в БД так же, как запланированная,
+        чтобы при остановке бота ее можно было продолжить с того же получателя.
+    """
+    data = await render_copy_source(bot, await state.get_data())
     logger.info(f"INFO: {data, data['content_type']}")
 
-    await execute_broadcast(bot, data, users, callback)
+    broadcast = await broadcast_repo.save_schedule(
+        callback.from_user.id,
+        data,
+        datetime.now(),
+        StatusBroadcast.PENDING,
+        session,
+    )
     await state.clear()
+    shutdown.spawn(execute_scheduled_broadcast(broadcast.id, callback))
 
 @router.callback_query(BroadcastStates.waiting_for_confirmation, F.data == "broadcast_schedule")
 async def show_schedule_options(callback: CallbackQuery, state: FSMContext):
@@ -141,6 +198,14 @@ async def handle_schedule_selection(callback: CallbackQuery, state: FSMContext,
         await callback.message.answer("Введите дату и время в формате DD.MM.YYYY HH:MM")
         await state.set_state(BroadcastStates.waiting_for_custom_time)
         return
+    elif action == "recurring":
+        await callback.message.edit_text(
+            "🔁 Выберите периодичность рассылки:",
+            reply_markup=get_recurrence_keyboard()
+        )
+        await state.set_state(BroadcastStates.waiting_for_recurrence)
+        await callback.answer()
+        return
     
     # Сохраняем и планируем рассылку
     broadcast = await save_and_schedule_broadcast(
@@ -182,6 +247,95 @@ async def handle_custom_time(message: Message, state: FSMContext, session):
     except ValueError:
         await message.answer("❌ Неверный формат. Введите дату в формате DD.MM.YYYY HH:MM")
 
+@router.callback_query(BroadcastStates.waiting_for_recurrence, F.data.startswith("recur_"))
+async def handle_recurrence_selection(callback: CallbackQuery, state: FSMContext):
+    """Обрабатывает выбор периодичности."""
+    action = callback.data.split("_")[1]
+
+    if action == "cancel":
+        await callback.message.edit_text("❌ Планирование отменено")
+        await state.clear()
+        return
+
+    if action == "cron":
+        await callback.message.answer("Введите cron-выражение, например: 0 9 * * *")
+        await state.set_state(BroadcastStates.waiting_for_cron)
+        await callback.answer()
+        return
+
+    await state.update_data(trigger="interval", trigger_args=RECURRENCE_PRESETS[action])
+    await callback.message.edit_text(
+        "👥 Кому отправлять при каждом запуске?",
+        reply_markup=get_audience_keyboard()
+    )
+    await state.set_state(BroadcastStates.waiting_for_audience)
+    await callback.answer()
+
+@router.message(BroadcastStates.waiting_for_cron, F.text)
+async def handle_cron(message: Message, state: FSMContext):
+    """Обрабатывает ручной ввод cron-выражения."""
+    try:
+        build_trigger("cron", {"crontab": message.text.strip()})
+    except ValueError:
+        await message.answer("❌ Неверное cron-выражение. Пример: 0 9 * * *")
+        return
+
+    await state.update_data(trigger="cron", trigger_args={"crontab": message.text.strip()})
+    await message.answer(
+        "👥 Кому отправлять при каждом запуске?",
+        reply_markup=get_audience_keyboard()
+    )
+    await state.set_state(BroadcastStates.waiting_for_audience)
+
+@router.callback_query(BroadcastStates.waiting_for_audience, F.data.startswith("audience_"))
+async def handle_audience_selection(callback: CallbackQuery, state: FSMContext, session):
+    """Сохраняет и планирует повторяющуюся рассылку."""
+    audience = callback.data.split("_")[1]
+    data = await state.get_data()
+    trigger = data.pop("trigger")
+    trigger_args = data.pop("trigger_args")
+
+    recurring = await save_and_schedule_recurring(
+        data,
+        trigger,
+        trigger_args,
+        audience,
+        callback.from_user.id,
+        session
+    )
+
+    await callback.message.edit_text(
+        f"✅ Повторяющаяся рассылка создана\n"
+        f"ID: {recurring.id}"
+    )
+    await state.clear()
+    await callback.answer()
+
+@router.message(Command("recurring"), IsModeratorFilter())
+async def list_recurring(message: Message, session):
+    """Список активных повторяющихся рассылок."""
+    recurring_list = await recurring_repo.get_active(session)
+    if not recurring_list:
+        await message.answer("Повторяющихся рассылок нет")
+        return
+
+    result = ""
+    for recurring in recurring_list:
+        schedule = recurring.trigger_args.get("crontab") or recurring.trigger_args
+        audience = "новым" if recurring.audience == "new" else "всем"
+        result += f"#{recurring.id} | {schedule} | {audience} | Последний запуск: {recurring.last_run_at}\n"
+    await message.answer(
+        result,
+        reply_markup=get_recurring_list_keyboard([recurring.id for recurring in recurring_list])
+    )
+
+@router.callback_query(F.data.startswith("rstop_"), IsModeratorFilter())
+async def stop_recurring_broadcast(callback: CallbackQuery, session):
+    recurring_id = int(callback.data.split("_")[1])
+    if await stop_recurring(recurring_id, session):
+        await callback.message.answer(f"⏹ Повторяющаяся рассылка #{recurring_id} отключена")
+    await callback.answer()
+
 @router.callback_query(BroadcastStates.waiting_for_confirmation, F.data == "broadcast_edit")
 async def edit_broadcast(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
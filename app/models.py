@@ -1,9 +1,10 @@
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, ForeignKey, DateTime, BigInteger
+from sqlalchemy import String, ForeignKey, DateTime, BigInteger, Index, Boolean, func
 from sqlalchemy.types import Text, JSON, DateTime
 from sqlalchemy.dialects.postgresql import ENUM as SqlEnum
 from enum import Enum
 from typing import Optional
+from datetime import datetime
 
 from core.db import Base
 
@@ -16,6 +17,10 @@ class UserRole(Enum):
 class User(Base):
     """Хранение пользователей и ролей."""
     __tablename__ = "user_info"
+    __table_args__ = (
+        Index("ix_user_info_registered_at_id", "registered_at", "id"),
+        Index("ix_user_info_role_id", "role", "id"),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     username: Mapped[Optional[str]] = mapped_column(String(30))
@@ -24,6 +29,11 @@ class User(Base):
         nullable=False,
         default=UserRole.USER
     )
+    registered_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        nullable=False,
+        server_default=func.now()
+    )
 
 class StatusBroadcast(Enum):
     PENDING = "pending"
@@ -33,6 +43,9 @@ class StatusBroadcast(Enum):
 class Broadcast(Base):
     """Данные рассылки и планирование."""
     __tablename__ = "broadcast"
+    __table_args__ = (
+        Index("ix_broadcast_status_scheduled_time", "status", "scheduled_time"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     created_by: Mapped[int] = mapped_column(ForeignKey("user_info.id"))
@@ -43,4 +56,38 @@ class Broadcast(Base):
         nullable=False,
         default=StatusBroadcast.PENDING
     )
-    stats: Mapped[dict] = mapped_column(JSON, nullable=True)
\ No newline at end of file
+    stats: Mapped[dict] = mapped_column(JSON, nullable=True)
+
+class BroadcastArchive(Base):
+    """Архив отправленных рассылок, чтобы очередь не росла со временем."""
+    __tablename__ = "broadcast_archive"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    created_by: Mapped[int] = mapped_column(BigInteger)
+    content: Mapped[dict] = mapped_column(JSON)
+    scheduled_time: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    status: Mapped[StatusBroadcast] = mapped_column(
+        SqlEnum(StatusBroadcast, name="status_broadcast", create_type=False),
+        nullable=False
+    )
+    stats: Mapped[dict] = mapped_column(JSON, nullable=True)
+
+class RecurringBroadcast(Base):
+    """
+        Повторяющаяся рассылка по расписанию (interval/cron).
+        audience "new" - только пользователям, зарегистрированным после прошлого запуска:
+        граница хранится как (last_registered_at, last_user_id) по индексу (registered_at, id).
+    """
+    __tablename__ = "recurring_broadcast"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    created_by: Mapped[int] = mapped_column(ForeignKey("user_info.id"))
+    content: Mapped[dict] = mapped_column(JSON)
+    trigger: Mapped[str] = mapped_column(String(10))
+    trigger_args: Mapped[dict] = mapped_column(JSON)
+    audience: Mapped[str] = mapped_column(String(10), default="all")
+    last_registered_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_user_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    last_run_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    active: Mapped[bool] = mapped_column(Boolean, default=True)
+    stats: Mapped[dict] = mapped_column(JSON, nullable=True)
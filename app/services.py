@@ -1,27 +1,35 @@
-import time
+import os
 import re
+import csv
+import gzip
 from aiogram import Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from collections import defaultdict
+from enum import Enum
 
+from .models import UserRole
+from .content import compile_content, visible_length, CAPTION_LIMIT, URL_SCHEMES
 from core.logger import logger
 from core.db import async_session
+from core.shutdown import shutdown
 from core.keyboards import get_confirmation_kb
 
+# Способ доставки рассылок: "copy" - copyMessage из одного исходного сообщения,
+# "send" - повторная отправка текста/медиа каждому получателю
+BROADCAST_DELIVERY = os.environ.get("BROADCAST_DELIVERY", "copy")
+
 # Состояния FSM
 class BroadcastStates(StatesGroup):
     waiting_for_content = State()
     waiting_for_confirmation = State()
 
 # Функции обработки данных
-def extract_buttons_from_text(text: str):
-    """Извлекает кнопки из текста в формате [Текст](URL)."""
-    buttons = re.findall(r'\[([^\]]+)\]\(([^\)]+)\)', text)
-    clean_text = re.sub(r'\[([^\]]+)\]\(([^\)]+)\)', '', text)
-    return buttons, clean_text.strip()
+def get_text_chunks(data: dict) -> list:
+    """Части текстовой рассылки (рассылки, сохраненные до разбиения, хранят один text)."""
+    return data.get('chunks') or [data['text']]
 
 def build_inline_kb(buttons_data):
     """Создает inline-клавиатуру из списка кнопок."""
@@ -30,7 +38,7 @@ def build_inline_kb(buttons_data):
         for btn in buttons_data:
             if len(btn) == 2:
                 text, url = btn
-                if url.startswith(('http://', 'https://')):
+                if url.startswith(URL_SCHEMES):
                     builder.button(text=text, url=url)
                 else:
                     builder.button(text=text, callback_data=url)
@@ -55,7 +63,7 @@ async def send_media_with_caption(bot: Bot, chat_id: int, data: dict):
     
     try:
         if data['content_type'] == "photo":
-            await bot.send_photo(
+            return await bot.send_photo(
                 chat_id=chat_id,
                 photo=data['file_id'],
                 caption=caption,
@@ -63,7 +71,7 @@ async def send_media_with_caption(bot: Bot, chat_id: int, data: dict):
                 parse_mode="HTML"
             )
         elif data['content_type'] == "video":
-            await bot.send_video(
+            return await bot.send_video(
                 chat_id=chat_id,
                 video=data['file_id'],
                 caption=caption,
@@ -71,7 +79,7 @@ async def send_media_with_caption(bot: Bot, chat_id: int, data: dict):
                 parse_mode="HTML"
             )
         elif data['content_type'] == "animation":
-            await bot.send_animation(
+            return await bot.send_animation(
                 chat_id=chat_id,
                 animation=data['file_id'],
                 caption=caption,
@@ -90,14 +98,26 @@ async def ask_confirmation(message: Message, state: FSMContext):
     data = await state.get_data()
     
     if data['content_type'] == "text":
-        preview_text = data['text'][:500] + ("" if len(data['text']) <= 500 else "...")
+        chunks = get_text_chunks(data)
+        preview_parts = compile_content(chunks[0], limit=500)[0]
+        preview_text = preview_parts[0] + ("" if len(preview_parts) == 1 and len(chunks) == 1 else "...")
         await message.answer(
             f"📋 <b>Предпросмотр рассылки:</b>\n\n{preview_text}\n\n"
-            f"🔲 Кнопок: {len(data.get('buttons', []))}\n\n"
+            f"🔲 Кнопок: {len(data.get('buttons', []))}\n"
+            f"📄 Сообщений: {len(chunks)}\n\n"
             "Подтвердите действие:",
             reply_markup=get_confirmation_kb(),
             parse_mode="HTML"
         )
+    elif data['content_type'] == "copy":
+        await message.answer(
+            f"📋 <b>Предпросмотр рассылки:</b>\n\n"
+            f"Сообщений будет скопировано как есть: {len(data['source_message_ids'])}\n\n"
+            "Подтвердите действие:",
+            reply_to_message_id=data['source_message_ids'][0],
+            reply_markup=get_confirmation_kb(),
+            parse_mode="HTML"
+        )
     else:
         await send_media_preview(message, data)
     
@@ -114,25 +134,36 @@ async def send_media_preview(message: Message, media_data: dict):
             f"🔲 Кнопок: {len(media_data.get('buttons', []))}\n"
             "Подтвердите действие:"
         )
+        caption = media_data.get('caption', '')
+        # Если подпись с текстом предпросмотра не влезает в лимит, предпросмотр идет отдельным сообщением
+        separate = visible_length(caption) + visible_length(preview_text) > CAPTION_LIMIT
+        caption = caption if separate else f"{caption}{preview_text}"
+        reply_markup = None if separate else get_confirmation_kb()
         
         if media_data['content_type'] == 'photo':
             await message.answer_photo(
                 photo=media_data['file_id'],
-                caption=f"{media_data.get('caption', '')}{preview_text}",
-                reply_markup=get_confirmation_kb(),
+                caption=caption,
+                reply_markup=reply_markup,
                 parse_mode="HTML"
             )
         elif media_data['content_type'] == 'video':
             await message.answer_video(
                 video=media_data['file_id'],
-                caption=f"{media_data.get('caption', '')}{preview_text}",
-                reply_markup=get_confirmation_kb(),
+                caption=caption,
+                reply_markup=reply_markup,
                 parse_mode="HTML"
             )
         elif media_data['content_type'] == 'animation':
             await message.answer_animation(
                 animation=media_data['file_id'],
-                caption=f"{media_data.get('caption', '')}{preview_text}",
+                caption=caption,
+                reply_markup=reply_markup,
+                parse_mode="HTML"
+            )
+        if separate:
+            await message.answer(
+                preview_text.strip(),
                 reply_markup=get_confirmation_kb(),
                 parse_mode="HTML"
             )
@@ -143,42 +174,117 @@ async def send_media_preview(message: Message, media_data: dict):
             parse_mode="HTML"
         )
 
-async def execute_broadcast(bot: Bot, data: dict, users: list, callback: CallbackQuery = None):
-    """Общая функция для выполнения рассылки (немедленной или запланированной)."""
-    if callback:
-        await safe_edit_message(message=callback, text="⏳ Рассылка начата...")
-    
+async def render_copy_source(bot: Bot, data: dict) -> dict:
+    """
+        Отрисовывает text/media рассылку в чат модератора при ее создании и возвращает data
+        с id этих сообщений в source_message_ids. Доставка, в том числе повторные запуски
+        и продолжение после перезапуска, только копирует их и ничего не отправляет заново.
+        Контент типа "copy" уже хранит исходные сообщения модератора.
+    """
+    if BROADCAST_DELIVERY != "copy" or data['content_type'] == "copy" or 'source_chat_id' not in data:
+        return data
+    chat_id = data['source_chat_id']
+    try:
+        if data['content_type'] == "text":
+            message_ids = []
+            for chunk in get_text_chunks(data):
+                message = await bot.send_message(chat_id=chat_id, text=chunk, parse_mode="HTML")
+                message_ids.append(message.message_id)
+        else:
+            message = await send_media_with_caption(bot=bot, chat_id=chat_id, data={**data, 'buttons': []})
+            message_ids = [message.message_id]
+    except Exception as e:
+        logger.error(f"Copy source error, broadcast will be sent without copying: {str(e)}")
+        return data
+    return {**data, 'source_message_ids': message_ids}
+
+async def copy_broadcast(bot: Bot, chat_id: int, from_chat_id: int, message_ids: list, reply_markup=None):
+    """Доставка рассылки копированием: в запросе только идентификаторы сообщений."""
+    if len(message_ids) == 1:
+        await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_ids[0],
+            reply_markup=reply_markup
+        )
+    elif reply_markup is None:
+        await bot.copy_messages(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_ids=message_ids
+        )
+    else:
+        # copyMessages не принимает клавиатуру, поэтому последняя часть копируется отдельно
+        await bot.copy_messages(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_ids=message_ids[:-1]
+        )
+        await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_ids[-1],
+            reply_markup=reply_markup
+        )
+
+async def prepare_delivery(bot: Bot, data: dict):
+    """
+        Готовит функцию доставки рассылки одному получателю.
+        Если при создании рассылки исходные сообщения отрисованы (render_copy_source),
+        доставка копирует их, иначе отправляет текст/медиа каждому получателю.
+    """
+    use_copy = data['content_type'] == "copy" or (BROADCAST_DELIVERY == "copy" and bool(data.get('source_message_ids')))
+    if use_copy:
+        from_chat_id = data['source_chat_id']
+        message_ids = data['source_message_ids']
+        reply_markup = build_inline_kb(data['buttons']) if data.get('buttons') else None
+    if data['content_type'] == "text":
+        chunks = get_text_chunks(data)
+
+    async def deliver(chat_id: int):
+        if use_copy:
+            await copy_broadcast(
+                bot=bot,
+                chat_id=chat_id,
+                from_chat_id=from_chat_id,
+                message_ids=message_ids,
+                reply_markup=reply_markup
+            )
+        elif data['content_type'] == "text":
+            for chunk in chunks[:-1]:
+                await bot.send_message(chat_id=chat_id, text=chunk, parse_mode="HTML")
+            await bot.send_message(
+                chat_id=chat_id,
+                text=chunks[-1],
+                reply_markup=build_inline_kb(data.get('buttons', [])),
+                parse_mode="HTML"
+            )
+        else:
+            await send_media_with_caption(
+                bot=bot,
+                chat_id=chat_id,
+                data=data
+            )
+    return deliver
+
+async def deliver_to_users(deliver, users: list):
+    """
+        Отправка рассылки списку пользователей (или строк с полем id).
+        При остановке бота цикл прерывается между получателями: обработано success + errors первых.
+    """
     success = 0
     errors = 0
     successful_users = []
-    start_time = time.perf_counter()
     for user in users:
+        if shutdown.should_stop():
+            break
         try:
-            if data['content_type'] == "text":
-                await bot.send_message(
-                    chat_id=user.id,
-                    text=data['text'],
-                    reply_markup=build_inline_kb(data.get('buttons', [])),
-                    parse_mode="HTML"
-                )
-            else:
-                await send_media_with_caption(
-                    bot=bot,
-                    chat_id=user.id,
-                    data=data
-                )
+            await deliver(user.id)
             successful_users.append(user.id)
             success += 1
         except Exception as e:
             errors += 1
             logger.error(f"Error sending to {user.id}: {str(e)}")
-    end_time = time.perf_counter()
-    # TODO при запланированной рассылке не пришел отчет
-    result_text = f"✅ Успешно: {success}\n❌ Ошибок: {errors}\n⏰ Время выполнения: {end_time - start_time} сек."
-    
-    if callback:
-        await safe_edit_message(message=callback, text=result_text)
-    
     return success, errors, successful_users
 
 # Функции для админа
@@ -190,9 +296,69 @@ async def parse_users_for_admin(user_repo, session):
         result[user.role.value] += 1
     return result
 
-async def parse_pending_brodcasts_for_admin(broadcast_repo, session):
-    result = {}
-    all_pending_broadcasts = await broadcast_repo.get_pending_broadcasts(session)
-    for br in all_pending_broadcasts:
-        result[br.id] = [br.created_by, br.scheduled_time]
-    return result
\ No newline at end of file
+def format_broadcasts_page(counts: dict, status: str, broadcasts) -> str:
+    """Текст страницы рассылок для админа: счетчики по статусам и список."""
+    result = " | ".join(f"{key}: {counts.get(key, 0)}" for key in ("pending", "sent", "failed"))
+    result += "\n\n"
+    if not broadcasts:
+        return result + "Рассылок нет"
+    for br in broadcasts:
+        result += f"#{br.id} | Модератор: {br.created_by} | Запланированное время: {br.scheduled_time}\n"
+    return result
+
+async def export_users_to_csv(user_repo, session, path: str, chunk_size: int = 1000) -> int:
+    """
+        Выгружает таблицу пользователей в gzip CSV по пачкам.
+        Колонки берутся из модели, поэтому новые поля попадут в выгрузку автоматически.
+    """
+    total = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        header_written = False
+        async for rows in user_repo.iter_user_rows(session, chunk_size):
+            if not header_written:
+                writer.writerow(rows[0]._fields)
+                header_written = True
+            writer.writerows(
+                [value.value if isinstance(value, Enum) else value for value in row]
+                for row in rows
+            )
+            total += len(rows)
+    return total
+
+def format_users_page(users) -> str:
+    """Текст страницы пользователей для админа."""
+    if not users:
+        return "Пользователи не найдены"
+    return "\n".join(
+        f"{user.id} | @{user.username or '-'} | {user.role.value}"
+        for user in users
+    )
+
+def parse_roles_file(text: str):
+    """
+        Разбирает файл вида "user_id,role" (разделитель - запятая, точка с запятой или пробел).
+        Пустые строки, комментарии (#) и заголовок пропускаются, при повторе id побеждает последняя строка.
+        Возвращает ({user_id: роль}, [(номер строки, строка)] с ошибками).
+    """
+    roles = {}
+    invalid = []
+    header_checked = False
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = re.split(r"[,;\s]+", line)
+        if len(parts) != 2:
+            invalid.append((number, line))
+            continue
+        user_id, role = parts
+        if not header_checked:
+            header_checked = True
+            if not user_id.isdigit():
+                continue
+        try:
+            roles[int(user_id)] = UserRole(role.lower())
+        except ValueError:
+            invalid.append((number, line))
+    return roles, invalid
@@ -1,25 +1,212 @@
 import os
+import time
+import hashlib
+import inspect
+from collections import OrderedDict
+from functools import wraps
 from dotenv import load_dotenv
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import Insert, Update, Delete, text, inspect as sa_inspect
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.exc import OperationalError, InterfaceError, DBAPIError
+from sqlalchemy.orm import DeclarativeBase, Session
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
+from .logger import logger
 
+
+# Единственная точка загрузки .env: модуль импортируется раньше остальных модулей бота
 load_dotenv()
 
 class Base(DeclarativeBase):
     pass
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
+# Необязательная реплика только для чтения. Если не задана, все запросы идут в основную БД
+READ_DATABASE_URL = os.environ.get("READ_DATABASE_URL")
+# Сколько секунд после записи чтения пользователя идут в основную БД (read-your-writes)
+READ_PIN_SECONDS = float(os.environ.get("READ_PIN_SECONDS", 5))
+# Сколько секунд не использовать реплику после ошибки подключения к ней
+READ_RETRY_SECONDS = float(os.environ.get("READ_RETRY_SECONDS", 30))
 
 engine = create_async_engine(
     DATABASE_URL,
     echo=True,
     )
+read_engine = create_async_engine(
+    READ_DATABASE_URL,
+    echo=True,
+    ) if READ_DATABASE_URL else None
+
+_replica_down_until = 0.0
+_write_pins: OrderedDict[int, float] = OrderedDict()
+_MAX_WRITE_PINS = 100_000
+
+
+def pin_to_primary(user_id: int) -> None:
+    """Направляет чтения пользователя в основную БД на READ_PIN_SECONDS после записи."""
+    _write_pins.pop(user_id, None)
+    _write_pins[user_id] = time.monotonic() + READ_PIN_SECONDS
+    if len(_write_pins) > _MAX_WRITE_PINS:
+        _write_pins.popitem(last=False)
+
+def is_pinned(user_id) -> bool:
+    now = time.monotonic()
+    while _write_pins:
+        key, expires = next(iter(_write_pins.items()))
+        if expires > now:
+            break
+        del _write_pins[key]
+    return user_id in _write_pins
+
+
+class RoutingSession(Session):
+    """
+        Сессия, выбирающая движок на каждый запрос.
+        В реплику идут только чтения, явно помеченные через @reads, если сессия еще
+        ничего не записала, пользователь не закреплен за основной БД и реплика доступна.
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.info["wrote"] = True
+            return engine.sync_engine
+        if (
+            read_engine is not None
+            and self.info.get("read")
+            and not self.info.get("wrote")
+            and time.monotonic() >= _replica_down_until
+            and not is_pinned(self.info.get("user_id"))
+        ):
+            self.info["used_replica"] = True
+            return read_engine.sync_engine
+        return engine.sync_engine
+
+
 async_session = async_sessionmaker(
     engine,
     expire_on_commit=False,
+    sync_session_class=RoutingSession,
     )
 
-async def init_db():
+
+def _session_getter(func):
+    signature = inspect.signature(func)
+    def get_session(args, kwargs):
+        return signature.bind(*args, **kwargs).arguments["session"]
+    return get_session
+
+def _mark_replica_down(e: Exception) -> None:
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + READ_RETRY_SECONDS
+    logger.error(f"Read replica unavailable, falling back to primary: {str(e)}")
+
+def reads(func):
+    """
+        Помечает метод репозитория как чтение: его запросы могут уйти в реплику.
+        При ошибке подключения к реплике корутина повторяется на основной БД.
+        Асинхронные генераторы тоже поддерживаются, но без повтора.
+    """
+    get_session = _session_getter(func)
+
+    if inspect.isasyncgenfunction(func):
+        @wraps(func)
+        async def gen_wrapper(*args, **kwargs):
+            session = get_session(args, kwargs)
+            agen = func(*args, **kwargs)
+            while True:
+                session.info["read"] = True
+                try:
+                    item = await agen.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    session.info["read"] = False
+                yield item
+        return gen_wrapper
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        session = get_session(args, kwargs)
+        session.info["read"] = True
+        session.info["used_replica"] = False
+        try:
+            return await func(*args, **kwargs)
+        except (OperationalError, InterfaceError, OSError) as e:
+            if not session.info.get("used_replica"):
+                raise
+            _mark_replica_down(e)
+            await session.rollback()
+            session.info["read"] = False
+            return await func(*args, **kwargs)
+        finally:
+            session.info["read"] = False
+    return wrapper
+
+def writes(func):
+    """
+        Помечает метод репозитория как запись: после него чтения этой сессии
+        и пользователя (на READ_PIN_SECONDS) идут в основную БД.
+    """
+    get_session = _session_getter(func)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        session = get_session(args, kwargs)
+        session.info["read"] = False
+        result = await func(*args, **kwargs)
+        session.info["wrote"] = True
+        if session.info.get("user_id") is not None:
+            pin_to_primary(session.info["user_id"])
+        return result
+    return wrapper
+
+SCHEMA_TABLE = "schema_fingerprint"
+
+def _create_schema(sync_conn) -> None:
+    """
+        create_all не меняет уже существующие таблицы, поэтому новые колонки
+        (только с server_default или nullable) и индексы добавляются отдельно.
+    """
+    Base.metadata.create_all(sync_conn)
+    inspector = sa_inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in existing:
+                ddl = CreateColumn(col).compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+def schema_fingerprint() -> str:
+    """Хэш описания таблиц, колонок и индексов моделей."""
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(table.name)
+        for col in table.columns:
+            parts.append(f"{col.name}:{col.type!r}:{col.nullable}:{col.primary_key}")
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            parts.append(f"index:{index.name}:{[col.name for col in index.columns]}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+async def init_db() -> bool:
+    """
+        Создает таблицы, если схема моделей изменилась с прошлого запуска.
+        Отпечаток схемы хранится в отдельной таблице: при совпадении запуск обходится
+        одним SELECT вместо рефлексии всех таблиц. Возвращает True, если выполнялся DDL.
+    """
+    fingerprint = schema_fingerprint()
+    try:
+        async with engine.connect() as conn:
+            stored = (await conn.execute(text(f"SELECT fingerprint FROM {SCHEMA_TABLE}"))).scalar()
+    except DBAPIError:
+        stored = None
+    if stored == fingerprint:
+        return False
+
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(_create_schema)
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (fingerprint VARCHAR(64) NOT NULL)"))
+        await conn.execute(text(f"DELETE FROM {SCHEMA_TABLE}"))
+        await conn.execute(text(f"INSERT INTO {SCHEMA_TABLE} (fingerprint) VALUES (:fingerprint)"), {"fingerprint": fingerprint})
+    logger.info(f"Схема БД обновлена, отпечаток {fingerprint[:12]}")
+    return True
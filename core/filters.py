@@ -4,6 +4,7 @@ from app.database import UserRepository
 
 from .logger import logger
 from .db import async_session
+from .tracing import trace_span
 
 
 user = UserRepository()
@@ -11,12 +12,14 @@ user = UserRepository()
 class IsAdminFilter(BaseFilter):
     async def __call__(self, message: types.Message) -> bool:
         logger.info(f"INFO:  {message.from_user.id}")
-        async with async_session() as session:
-            role = await user.get_user_role(message.from_user.id, session)
-            return role == "admin"
+        with trace_span("filter.IsAdminFilter"):
+            async with async_session() as session:
+                role = await user.get_user_role(message.from_user.id, session)
+                return role == "admin"
     
 class IsModeratorFilter(BaseFilter):
     async def __call__(self, message: types.Message) -> bool:
-        async with async_session() as session:
-            role = await user.get_user_role(message.from_user.id, session)
-            return role in ["moderator", "admin"]
\ No newline at end of file
+        with trace_span("filter.IsModeratorFilter"):
+            async with async_session() as session:
+                role = await user.get_user_role(message.from_user.id, session)
+                return role in ["moderator", "admin"]
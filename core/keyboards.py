@@ -10,8 +10,16 @@ def get_admin_keyboard():
         KeyboardButton(text="/all_users"),
         KeyboardButton(text="/all_broadcasts")
     )
+    builder.row(
+        KeyboardButton(text="/users"),
+        KeyboardButton(text="/export_users")
+    )
     builder.row(
         KeyboardButton(text="/give_role"),
+        KeyboardButton(text="/bulk_roles")
+    )
+    builder.row(
+        KeyboardButton(text="/archive_broadcasts"),
     )
     return builder.as_markup(resize_keyboard=True)
 
@@ -20,6 +28,7 @@ def get_moderator_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.row(
         KeyboardButton(text="/broadcast"),
+        KeyboardButton(text="/recurring"),
     )
     return builder.as_markup(resize_keyboard=True)
 
@@ -55,7 +64,71 @@ def get_schedule_keyboard():
         InlineKeyboardButton(text="Через 3 часа", callback_data="schedule_3h"),
         InlineKeyboardButton(text="Завтра", callback_data="schedule_tomorrow"),
         InlineKeyboardButton(text="Указать время", callback_data="schedule_custom"),
+        InlineKeyboardButton(text="🔁 Повторять", callback_data="schedule_recurring"),
         InlineKeyboardButton(text="Отмена", callback_data="schedule_cancel"),
     )
+    builder.adjust(2, 2, 1, 1)
+    return builder.as_markup()
+
+def get_recurrence_keyboard():
+    """Клавиатура выбора периодичности повторяющейся рассылки."""
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text="Каждый час", callback_data="recur_1h"),
+        InlineKeyboardButton(text="Каждый день", callback_data="recur_1d"),
+        InlineKeyboardButton(text="Каждую неделю", callback_data="recur_1w"),
+        InlineKeyboardButton(text="Cron-выражение", callback_data="recur_cron"),
+        InlineKeyboardButton(text="Отмена", callback_data="recur_cancel"),
+    )
     builder.adjust(2, 2, 1)
-    return builder.as_markup()
\ No newline at end of file
+    return builder.as_markup()
+
+def get_audience_keyboard():
+    """Клавиатура выбора аудитории повторяющейся рассылки."""
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text="Всем пользователям", callback_data="audience_all"),
+        InlineKeyboardButton(text="Только новым с прошлого запуска", callback_data="audience_new"),
+    )
+    builder.adjust(1)
+    return builder.as_markup()
+
+def get_recurring_list_keyboard(recurring_ids):
+    """Кнопки отключения повторяющихся рассылок."""
+    builder = InlineKeyboardBuilder()
+    for recurring_id in recurring_ids:
+        builder.button(text=f"⏹ #{recurring_id}", callback_data=f"rstop_{recurring_id}")
+    builder.adjust(3)
+    return builder.as_markup()
+
+def get_users_page_keyboard(role: str, first_id: int, last_id: int, has_prev: bool, has_next: bool):
+    """
+        Клавиатура постраничного просмотра пользователей.
+        callback_data: users:<роль|all>:<n|p>:<курсор>, где курсор - id граничного пользователя.
+    """
+    builder = InlineKeyboardBuilder()
+    for value, title in (("all", "Все"), ("user", "User"), ("moderator", "Moderator"), ("admin", "Admin")):
+        mark = "• " if value == role else ""
+        builder.button(text=f"{mark}{title}", callback_data=f"users:{value}:n:0")
+    if has_prev:
+        builder.button(text="◀️", callback_data=f"users:{role}:p:{first_id}")
+    if has_next:
+        builder.button(text="▶️", callback_data=f"users:{role}:n:{last_id}")
+    builder.adjust(4)
+    return builder.as_markup()
+
+def get_broadcasts_page_keyboard(status: str, first, last, has_prev: bool, has_next: bool):
+    """
+        Клавиатура постраничного просмотра рассылок.
+        callback_data: bc:<статус>:<n|p>:<id>:<время>, курсор - граничная рассылка страницы.
+    """
+    builder = InlineKeyboardBuilder()
+    for value, title in (("pending", "Ожидают"), ("sent", "Отправлены"), ("failed", "Ошибки")):
+        mark = "• " if value == status else ""
+        builder.button(text=f"{mark}{title}", callback_data=f"bc:{value}:n")
+    if has_prev:
+        builder.button(text="◀️", callback_data=f"bc:{status}:p:{first.id}:{first.scheduled_time.isoformat()}")
+    if has_next:
+        builder.button(text="▶️", callback_data=f"bc:{status}:n:{last.id}:{last.scheduled_time.isoformat()}")
+    builder.adjust(3)
+    return builder.as_markup()
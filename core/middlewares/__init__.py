@@ -1,8 +1,46 @@
-from aiogram import Dispatcher
+import os
+
+from aiogram import Dispatcher, Router
 
 from ..db import async_session
+from ..logger import logger
+from ..shutdown import shutdown
 from .database import DatabaseMiddleware
+from .throttling import ThrottlingMiddleware
+from .tracing import TracingMiddleware, HandlerTracingMiddleware
 
 
 def setup_middlewares(dp: Dispatcher) -> None:
-    dp.update.middleware(DatabaseMiddleware(async_session))
\ No newline at end of file
+    dp.update.outer_middleware(TracingMiddleware(
+        slow_ms=float(os.environ.get("TRACE_SLOW_MS", 1000)),
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", 0)),
+        sample_path=os.environ.get("TRACE_SAMPLE_PATH", "traces.jsonl"),
+        max_spans=int(os.environ.get("TRACE_MAX_SPANS", 500)),
+    ))
+
+    throttling = ThrottlingMiddleware(
+        rate=1.0,
+        burst=5.0,
+        limits={
+            "start": (0.2, 2.0),
+        },
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    shutdown.add_flush(lambda: logger.info(f"Throttling: {throttling.stats()}"))
+    dp.update.middleware(DatabaseMiddleware(async_session))
+
+    dp.message.middleware(HandlerTracingMiddleware())
+    dp.callback_query.middleware(HandlerTracingMiddleware())
+
+
+def setup_router_throttling(router: Router, rate: float, burst: float) -> ThrottlingMiddleware:
+    """
+        Отдельный лимит для роутера поверх общего. Outer-middleware роутера видит апдейты,
+        которые дошли до него, то есть не обработаны роутерами, подключенными раньше.
+    """
+    throttling = ThrottlingMiddleware(rate=rate, burst=burst)
+    router.message.outer_middleware(throttling)
+    router.callback_query.outer_middleware(throttling)
+    shutdown.add_flush(lambda: logger.info(f"Throttling {router.name}: {throttling.stats()}"))
+    return throttling
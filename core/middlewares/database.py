@@ -3,12 +3,17 @@ from typing import Any
 from aiogram import BaseMiddleware
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from ..tracing import trace_span
+
 
 class DatabaseMiddleware(BaseMiddleware):
     def __init__(self, session_pool: async_sessionmaker):
         self.session_pool = session_pool
 
     async def __call__(self, handler, event, data) -> Any:
-        async with self.session_pool() as session:
-            data["session"] = session
-            return await handler(event, data)
\ No newline at end of file
+        with trace_span("middleware.database"):
+            async with self.session_pool() as session:
+                user = data.get("event_from_user")
+                session.info["user_id"] = user.id if user else None
+                data["session"] = session
+                return await handler(event, data)
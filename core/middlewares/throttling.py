@@ -0,0 +1,149 @@
+import asyncio
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from ..logger import logger
+
+
+class TokenBucketStore:
+    """
+        Компактное хранилище token bucket'ов по ключу (id пользователя).
+        Запись хранится как кортеж (токены, время обновления) и удаляется, как только
+        bucket успел бы полностью восстановиться - такая запись ничем не отличается от новой.
+        Размер ограничен max_size: при переполнении вытесняются давно неактивные ключи.
+        Если ожидание не больше max_delay, токен резервируется заранее (баланс уходит в минус),
+        поэтому задержанные апдейты тоже подчиняются лимиту.
+    """
+    def __init__(self, rate: float, burst: float, max_size: int = 100_000, max_delay: float = 0.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.max_delay = max_delay
+        # Восстановление из самого глубокого минуса (-max_delay * rate) до burst
+        self.ttl = burst / rate + max_delay
+        self._buckets: OrderedDict[int, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: int, now: Optional[float] = None) -> float:
+        """
+            Забирает токен. Возвращает 0, если токен есть, иначе время ожидания в секундах.
+            Если ожидание не больше max_delay, токен уже зарезервирован, иначе bucket не меняется.
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1 if wait <= self.max_delay else tokens, now)
+
+        if len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def _expire(self, now: float) -> None:
+        """Удаляет записи, которые уже полностью восстановились (самые старые - в начале)."""
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.ttl:
+                break
+            del self._buckets[key]
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+        Ограничение частоты входящих апдейтов от одного пользователя.
+        Регистрируется как outer-middleware, поэтому срабатывает до фильтров ролей и хендлеров:
+        отброшенный апдейт не делает ни одного запроса в БД.
+
+        limits - отдельные лимиты {ключ: (rate, burst)}, где ключ - команда без "/"
+        ("start") или префикс callback_data до "_" или ":" ("role", "users").
+        Если ожидание не превышает max_delay, апдейт задерживается, иначе отбрасывается.
+        Лимит на роутер - отдельный экземпляр на его observer'ах (см. setup_router_throttling).
+    """
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: float = 5.0,
+        limits: Optional[dict[str, tuple[float, float]]] = None,
+        max_delay: float = 0.0,
+        max_size: int = 100_000,
+    ):
+        self.max_delay = max_delay
+        self.default = TokenBucketStore(rate, burst, max_size, max_delay)
+        self.stores = {
+            key: TokenBucketStore(key_rate, key_burst, max_size, max_delay)
+            for key, (key_rate, key_burst) in (limits or {}).items()
+        }
+        self.dropped = Counter()
+        self.delayed = Counter()
+        self._media_groups: OrderedDict[str, float] = OrderedDict()
+
+    async def __call__(self, handler, event, data) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        if isinstance(event, Message) and event.media_group_id and self._seen_media_group(event.media_group_id):
+            # Альбом приходит пачкой сообщений, лимит тратится только на первое
+            return await handler(event, data)
+
+        key = self._get_key(event)
+        if key not in self.stores:
+            key = "*"
+        store = self.stores.get(key, self.default)
+        wait = store.acquire(user.id)
+
+        if wait > 0:
+            if wait > self.max_delay:
+                self.dropped[key] += 1
+                if self.dropped.total() % 1000 == 1:
+                    logger.warning(f"Throttling: отброшено апдейтов {dict(self.dropped)}")
+                if isinstance(event, CallbackQuery):
+                    # Без ответа у пользователя крутится индикатор загрузки на кнопке
+                    await event.answer()
+                return None
+            self.delayed[key] += 1
+            await asyncio.sleep(wait)
+
+        return await handler(event, data)
+
+    def _seen_media_group(self, media_group_id: str, ttl: float = 60.0, max_size: int = 10_000) -> bool:
+        """Запоминает альбом и возвращает True, если его сообщения уже приходили."""
+        now = time.monotonic()
+        while self._media_groups and next(iter(self._media_groups.values())) < now - ttl:
+            self._media_groups.popitem(last=False)
+        if media_group_id in self._media_groups:
+            return True
+        self._media_groups[media_group_id] = now
+        if len(self._media_groups) > max_size:
+            self._media_groups.popitem(last=False)
+        return False
+
+    @staticmethod
+    def _get_key(event) -> str:
+        """Ключ лимита: команда для сообщений, префикс callback_data для кнопок."""
+        if isinstance(event, Message) and event.text and event.text.startswith("/"):
+            return event.text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+        if isinstance(event, CallbackQuery) and event.data:
+            return re.split(r"[_:]", event.data, maxsplit=1)[0]
+        return "*"
+
+    def stats(self) -> dict:
+        """Счетчики отброшенных и задержанных апдейтов."""
+        return {
+            "dropped": dict(self.dropped),
+            "delayed": dict(self.delayed),
+            "tracked_users": len(self.default) + sum(len(s) for s in self.stores.values()),
+        }
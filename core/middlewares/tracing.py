@@ -0,0 +1,48 @@
+import json
+import random
+from typing import Any
+
+from aiogram import BaseMiddleware
+
+from ..logger import logger
+from ..tracing import Span, trace_root, trace_span
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+        Корневой спан апдейта. Регистрируется первым outer-middleware на dp.update.
+        Апдейты дольше slow_ms логируются с разбивкой по спанам, доля sample_rate
+        пишется в файл sample_path в формате JSON lines.
+        Дерево одного апдейта ограничено max_spans спанами, остальные только считаются.
+    """
+    def __init__(self, slow_ms: float = 1000.0, sample_rate: float = 0.0, sample_path: str = "traces.jsonl", max_spans: int = 500):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.sample_path = sample_path
+        self.max_spans = max_spans
+
+    async def __call__(self, handler, event, data) -> Any:
+        update_id = getattr(event, "update_id", None)
+        try:
+            with trace_root("update", self.max_spans, update_id=update_id, type=getattr(event, "event_type", None)) as root:
+                return await handler(event, data)
+        finally:
+            self._report(root)
+
+    def _report(self, root: Span) -> None:
+        if root.duration_ms >= self.slow_ms:
+            logger.warning(f"Медленный апдейт {root.duration_ms:.1f}ms:\n{root.format()}")
+        if self.sample_rate and random.random() < self.sample_rate:
+            try:
+                with open(self.sample_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(root.to_dict(root.start), ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                logger.error(f"Не удалось записать трассировку: {str(e)}")
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Спан хендлера. Регистрируется как inner-middleware, поэтому не включает фильтры."""
+    async def __call__(self, handler, event, data) -> Any:
+        callback = getattr(data.get("handler"), "callback", None)
+        with trace_span(f"handler.{getattr(callback, '__name__', 'unknown')}"):
+            return await handler(event, data)
@@ -1,40 +1,64 @@
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from apscheduler.jobstores.redis import RedisJobStore
-from sqlalchemy import create_engine, select
-from dotenv import load_dotenv
-
-from app.database import BroadcastRepository
-from app.models import StatusBroadcast, Broadcast, User
-from app.services import execute_broadcast
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.jobstores.base import JobLookupError
+
+from app.database import BroadcastRepository, UserRepository, RecurringBroadcastRepository
+from app.models import StatusBroadcast, Broadcast, RecurringBroadcast
+from app.services import prepare_delivery, deliver_to_users, safe_edit_message, render_copy_source
 from .db import async_session
 from .logger import logger
+from .shutdown import shutdown
 
 
-load_dotenv()
+scheduler = AsyncIOScheduler()
 
-"""Используем синхронный движок БД, для работы с apscheduler"""
-DATABASE_URL = os.getenv("DATABASE_URL").replace("+asyncpg", "+psycopg2")
+# Насколько рассылка может опоздать (например, пока бот не работал), чтобы ее еще отправили.
+# Более старые и ни разу не начатые рассылки при запуске помечаются FAILED
+BROADCAST_MAX_LATENESS_SECONDS = float(os.environ.get("BROADCAST_MAX_LATENESS_SECONDS", 3600))
 
-sync_engine = create_engine(DATABASE_URL)
-jobstore = SQLAlchemyJobStore(engine=sync_engine)
+def create_jobstore():
+    """
+        Используем синхронный движок БД, для работы с apscheduler.
+        Движок и хранилище задач создаются при запуске планировщика, а не при импорте модуля.
+    """
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from sqlalchemy import create_engine
 
-scheduler = AsyncIOScheduler()
-scheduler.add_jobstore(jobstore)
+    sync_engine = create_engine(os.getenv("DATABASE_URL").replace("+asyncpg", "+psycopg2"))
+    return SQLAlchemyJobStore(engine=sync_engine)
 
 async def init_scheduler(bot):
     scheduler._bot = bot
     if not scheduler.running:
+        scheduler.add_jobstore(create_jobstore())
+        # cron, а не interval: новый интервальный триггер при каждом запуске отодвигал бы
+        # архивацию на сутки вперед, и при частых перезапусках она не выполнялась бы никогда
+        scheduler.add_job(
+            archive_sent_broadcasts,
+            'cron',
+            hour=3,
+            id="archive_broadcasts",
+            replace_existing=True
+        )
+        # До старта планировщика: иначе пропущенные задачи из хранилища успели бы отправить
+        # устаревшие рассылки
+        await expire_stale_broadcasts()
         scheduler.start()
+        await resume_broadcasts()
 
 # Функции для работы с задачами
 
 broadcast_repo = BroadcastRepository()
+user_repo = UserRepository()
+recurring_repo = RecurringBroadcastRepository()
 
 async def save_and_schedule_broadcast(data: dict, scheduled_time: datetime, user_id: int, session):
     """Сохраняет рассылку в БД и планирует задачу."""
+    data = await render_copy_source(scheduler._bot, data)
     broadcast = await broadcast_repo.save_schedule(
         user_id,
         data,
@@ -49,32 +73,257 @@ async def save_and_schedule_broadcast(data: dict, scheduled_time: datetime, user
         'date',
         run_date=scheduled_time,
         args=[broadcast.id],
-        id=f"broadcast_{broadcast.id}"
+        id=f"broadcast_{broadcast.id}",
+        misfire_grace_time=None
     )
     return broadcast
 
-async def execute_scheduled_broadcast(broadcast_id: int, session):
-    """Выполнение запланированной рассылки."""
-    broadcast = await session.get(Broadcast, broadcast_id)
-    if not broadcast or broadcast.status != StatusBroadcast.PENDING:
+# Рассылки выполняются пачками, после каждой пачки позиция сохраняется в stats["resume_after"],
+# поэтому прерванная остановкой или падением рассылка продолжается с того же места
+_running = set()
+
+async def deliver_in_chunks(bot, data: dict, chunks, stats: dict, position, checkpoint) -> bool:
+    """
+        Отправляет рассылку по пачкам получателей и сохраняет прогресс через checkpoint(stats).
+        Контент готовится только при первой непустой пачке.
+        Возвращает False, если рассылка остановлена раньше, чем закончилась аудитория.
+    """
+    deliver = None
+    async for rows in chunks:
+        if deliver is None:
+            deliver = await prepare_delivery(bot, data)
+        success, errors, _ = await deliver_to_users(deliver, rows)
+        processed = success + errors
+        stats["total"] += processed
+        stats["success"] += success
+        stats["errors"] += errors
+        if processed:
+            stats["resume_after"] = position(rows[processed - 1])
+        await checkpoint(stats)
+        if processed < len(rows):
+            return False
+    return True
+
+async def expire_stale_broadcasts():
+    """Не отправляет рассылки, опоздавшие больше чем на BROADCAST_MAX_LATENESS_SECONDS."""
+    cutoff = datetime.now() - timedelta(seconds=BROADCAST_MAX_LATENESS_SECONDS)
+    async with async_session() as session:
+        expired = await broadcast_repo.expire_stale_broadcasts(cutoff, session)
+    if expired:
+        logger.warning(f"Expired stale broadcasts: {expired}, scheduled before {cutoff}")
+
+def make_checkpoint(save_progress, item_id: int, read_session):
+    """
+        Сохранение позиции рассылки в отдельной короткой сессии.
+        Сессия, читающая получателей, ничего не пишет, поэтому ее чтения остаются в реплике;
+        после сохранения ее транзакция завершается, чтобы не держать снимок всю рассылку.
+    """
+    async def checkpoint(stats):
+        async with async_session() as write_session:
+            await save_progress(item_id, dict(stats), write_session)
+        await read_session.commit()
+    return checkpoint
+
+async def resume_broadcasts():
+    """
+        Запускает прерванные рассылки и те, время которых наступило, пока бот не работал.
+        Устаревшие рассылки к этому моменту уже помечены FAILED (expire_stale_broadcasts).
+    """
+    now = datetime.now()
+    due = 0
+    async with async_session() as session:
+        async for rows in broadcast_repo.iter_due_broadcasts(now, session):
+            for row in rows:
+                scheduler.add_job(
+                    execute_scheduled_broadcast,
+                    'date',
+                    run_date=now,
+                    args=[row.id],
+                    id=f"broadcast_{row.id}",
+                    misfire_grace_time=None,
+                    replace_existing=True
+                )
+            due += len(rows)
+        interrupted = [
+            recurring for recurring in await recurring_repo.get_active(session)
+            if recurring.stats and "resume_after" in recurring.stats
+        ]
+    for recurring in interrupted:
+        scheduler.add_job(
+            execute_recurring_broadcast,
+            'date',
+            run_date=now,
+            args=[recurring.id],
+            id=f"recurring_resume_{recurring.id}",
+            misfire_grace_time=None,
+            replace_existing=True
+        )
+    if due or interrupted:
+        logger.info(f"Resumed broadcasts: {due}, recurring: {len(interrupted)}")
+
+async def execute_scheduled_broadcast(broadcast_id: int, callback=None):
+    """Выполнение рассылки (запланированной или немедленной) с продолжением после перезапуска."""
+    key = f"broadcast_{broadcast_id}"
+    if key in _running or shutdown.draining:
         return
-    
-    bot = scheduler._bot
-    users = await session.execute(select(User))
-    users = users.scalars().all()
-    
-    success, errors, successful_users = await execute_broadcast(
-        bot=bot,
-        data=broadcast.content,
-        users=users
+    _running.add(key)
+    try:
+        async with shutdown.track(), async_session() as session:
+            broadcast = await session.get(Broadcast, broadcast_id)
+            if not broadcast or broadcast.status != StatusBroadcast.PENDING:
+                return
+            if callback:
+                await safe_edit_message(message=callback, text="⏳ Рассылка начата...")
+
+            stats = {"total": 0, "success": 0, "errors": 0, **(broadcast.stats or {})}
+            checkpoint = make_checkpoint(broadcast_repo.save_progress, broadcast_id, session)
+
+            start_time = time.perf_counter()
+            finished = await deliver_in_chunks(
+                scheduler._bot,
+                broadcast.content,
+                user_repo.iter_user_rows(session, after_id=stats.get("resume_after")),
+                stats,
+                lambda row: row.id,
+                checkpoint
+            )
+            end_time = time.perf_counter()
+
+            # Обновляем статус
+            if finished:
+                stats.pop("resume_after", None)
+                broadcast.status = StatusBroadcast.SENT
+                broadcast.stats = stats
+                await session.commit()
+
+            result_text = f"✅ Успешно: {stats['success']}\n❌ Ошибок: {stats['errors']}\n⏰ Время выполнения: {end_time - start_time} сек."
+            if not finished:
+                result_text = "⏸ Рассылка приостановлена из-за перезапуска бота и продолжится после него\n" + result_text
+            if callback:
+                await safe_edit_message(message=callback, text=result_text)
+    finally:
+        _running.discard(key)
+
+# Повторяющиеся рассылки
+
+def build_trigger(trigger: str, trigger_args: dict):
+    """Триггер apscheduler из сохраненного описания: interval с аргументами или cron-строка."""
+    if trigger == "cron":
+        return CronTrigger.from_crontab(trigger_args["crontab"])
+    return IntervalTrigger(**trigger_args)
+
+async def save_and_schedule_recurring(data: dict, trigger: str, trigger_args: dict, audience: str, user_id: int, session):
+    """
+        Сохраняет повторяющуюся рассылку и планирует задачу.
+        Для audience "new" граница ставится на последнего зарегистрированного пользователя
+        (с отставанием, см. get_registration_mark), поэтому первый запуск получат те, кто
+        придет после создания рассылки, и зарегистрировавшиеся за последнюю минуту до него.
+    """
+    data = await render_copy_source(scheduler._bot, data)
+    mark = await user_repo.get_registration_mark(session) if audience == "new" else None
+    recurring = await recurring_repo.save(
+        user_id,
+        data,
+        trigger,
+        trigger_args,
+        audience,
+        mark,
+        session,
+        )
+
+    scheduler.add_job(
+        execute_recurring_broadcast,
+        build_trigger(trigger, trigger_args),
+        args=[recurring.id],
+        id=f"recurring_{recurring.id}",
+        replace_existing=True
     )
-    
-    # Обновляем статус
-    broadcast.status = StatusBroadcast.SENT
-    broadcast.stats = {
-        "total": len(users),
-        "success": success,
-        "errors": errors
-    }
-    
-    await session.commit()
\ No newline at end of file
+    return recurring
+
+async def stop_recurring(recurring_id: int, session) -> bool:
+    """Отключает повторяющуюся рассылку и удаляет ее задачу."""
+    try:
+        scheduler.remove_job(f"recurring_{recurring_id}")
+    except JobLookupError:
+        pass
+    return await recurring_repo.deactivate(recurring_id, session)
+
+def _encode_mark(mark):
+    return [mark[0].isoformat(), mark[1]] if mark else None
+
+def _decode_mark(mark):
+    return (datetime.fromisoformat(mark[0]), mark[1]) if mark else None
+
+async def execute_recurring_broadcast(recurring_id: int):
+    """
+        Запуск повторяющейся рассылки.
+        Верхняя граница аудитории фиксируется до отправки: пользователи, пришедшие
+        во время рассылки, попадут в следующий запуск. Получатели читаются пачками.
+        Если прошлый запуск был прерван, сначала доводится до конца он.
+    """
+    key = f"recurring_{recurring_id}"
+    if key in _running or shutdown.draining:
+        return
+    _running.add(key)
+    try:
+        async with shutdown.track(), async_session() as session:
+            recurring = await session.get(RecurringBroadcast, recurring_id)
+            if not recurring or not recurring.active:
+                try:
+                    scheduler.remove_job(key)
+                except JobLookupError:
+                    pass
+                return
+
+            stats = dict(recurring.stats or {})
+            if "resume_after" in stats:
+                upto = _decode_mark(stats["upto"])
+                resume_after = stats["resume_after"]
+            else:
+                upto = await user_repo.get_registration_mark(session)
+                stats = {"total": 0, "success": 0, "errors": 0, "upto": _encode_mark(upto)}
+                resume_after = None
+
+            if recurring.audience == "new" and upto is None:
+                # Еще нет пользователей старше отставания границы: без верхней границы
+                # следующий запуск отправил бы им рассылку повторно
+                await recurring_repo.save_run(recurring, None, datetime.now(), stats, session)
+                logger.info(f"Recurring broadcast {recurring_id}: no eligible users")
+                return
+
+            if recurring.audience == "new":
+                after = _decode_mark(resume_after)
+                if after is None and recurring.last_registered_at is not None:
+                    after = (recurring.last_registered_at, recurring.last_user_id)
+                chunks = user_repo.iter_registered_users(session, after=after, upto=upto)
+                position = lambda row: _encode_mark((row.registered_at, row.id))
+            else:
+                chunks = user_repo.iter_user_rows(session, after_id=resume_after)
+                position = lambda row: row.id
+
+            checkpoint = make_checkpoint(recurring_repo.save_progress, recurring_id, session)
+
+            finished = await deliver_in_chunks(
+                scheduler._bot,
+                recurring.content,
+                chunks,
+                stats,
+                position,
+                checkpoint
+            )
+            if not finished:
+                logger.info(f"Recurring broadcast {recurring_id} paused after {stats['total']} recipients")
+                return
+
+            stats.pop("resume_after", None)
+            stats.pop("upto", None)
+            await recurring_repo.save_run(recurring, upto, datetime.now(), stats, session)
+        logger.info(f"Recurring broadcast {recurring_id}: {stats['total']} recipients, {stats['errors']} errors")
+    finally:
+        _running.discard(key)
+
+async def archive_sent_broadcasts():
+    """Ежедневный перенос отправленных рассылок старше суток в архив."""
+    async with async_session() as session:
+        archived = await broadcast_repo.archive_broadcasts(datetime.now() - timedelta(days=1), session)
+    logger.info(f"Archived broadcasts: {archived}")
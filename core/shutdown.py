@@ -0,0 +1,85 @@
+"""
+Корректная остановка бота: активные рассылки дорабатывают до дедлайна и
+сохраняют позицию, с которой продолжатся после перезапуска.
+"""
+import asyncio
+import inspect
+import os
+import time
+from contextlib import asynccontextmanager
+
+from .logger import logger
+from .tracing import untraced
+
+
+class ShutdownCoordinator:
+    """
+        Отслеживает задачи рассылок и буферы, которые нужно сбросить при остановке.
+        Рассылки проверяют should_stop() между получателями, поэтому останавливаются
+        на границе отправки, а не посреди запроса к Telegram.
+    """
+    def __init__(self, drain_seconds: float = None, grace_seconds: float = 5.0):
+        self.drain_seconds = drain_seconds
+        self.grace_seconds = grace_seconds
+        self._deadline = None
+        self._tasks: set[asyncio.Task] = set()
+        self._flush_callbacks = []
+
+    @property
+    def draining(self) -> bool:
+        return self._deadline is not None
+
+    def should_stop(self) -> bool:
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+            Запускает рассылку отдельной задачей, которую остановка дождется.
+            Задача не наследует трассировку апдейта, из хендлера которого запущена.
+        """
+        task = asyncio.create_task(untraced(coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @asynccontextmanager
+    async def track(self):
+        """Регистрирует текущую задачу (например, задачу планировщика) как активную рассылку."""
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            yield
+        finally:
+            self._tasks.discard(task)
+
+    def add_flush(self, callback) -> None:
+        """Функция (или корутина), которая вызывается после остановки рассылок."""
+        self._flush_callbacks.append(callback)
+
+    async def drain(self) -> None:
+        """
+            Дает активным рассылкам drain_seconds на работу в обычном темпе, затем
+            ждет еще grace_seconds, пока они сохранят позицию, и сбрасывает буферы.
+        """
+        if self.drain_seconds is None:
+            self.drain_seconds = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", 8))
+        self._deadline = time.monotonic() + self.drain_seconds
+        tasks = {task for task in self._tasks if task is not asyncio.current_task()}
+        if tasks:
+            logger.info(f"Shutdown: ожидание {len(tasks)} рассылок, не дольше {self.drain_seconds} сек.")
+            _, pending = await asyncio.wait(tasks, timeout=self.drain_seconds + self.grace_seconds)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.error(f"Shutdown: {len(pending)} рассылок прерваны без сохранения позиции")
+
+        for callback in self._flush_callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Shutdown flush error: {str(e)}")
+
+
+shutdown = ShutdownCoordinator()
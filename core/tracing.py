@@ -0,0 +1,149 @@
+"""
+Трассировка обработки апдейтов: дерево спанов (middleware, фильтры, хендлер,
+SQL-запросы, запросы к Bot API) для каждого апдейта.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children", "root", "budget")
+
+    def __init__(self, name: str, root: Optional["Span"] = None, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: list["Span"] = []
+        self.root = root if root is not None else self
+        # Сколько еще дочерних спанов может собрать дерево (хранится только у корня)
+        self.budget = 0
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"children": [c.to_dict(origin) for c in self.children]} if self.children else {}),
+        }
+
+    def format(self, max_lines: int = 200) -> str:
+        """Дерево спанов построчно, не длиннее max_lines строк."""
+        lines = []
+        total = 0
+        for line in self._lines(0):
+            total += 1
+            if total <= max_lines:
+                lines.append(line)
+        if total > max_lines:
+            lines.append(f"... еще {total - max_lines} спанов")
+        return "\n".join(lines)
+
+    def _lines(self, depth: int):
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        yield f"{'  ' * depth}{self.name} {self.duration_ms:.1f}ms {attrs}".rstrip()
+        for child in self.children:
+            yield from child._lines(depth + 1)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def start_span(name: str, **attrs) -> Optional[Span]:
+    """
+        Открывает дочерний спан текущего апдейта (или ничего, если трассировка не идет).
+        Когда дерево апдейта собрало max_spans спанов, новые только считаются
+        в атрибуте dropped_spans корня.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    root = parent.root
+    if root.budget <= 0:
+        root.attrs["dropped_spans"] = root.attrs.get("dropped_spans", 0) + 1
+        return None
+    root.budget -= 1
+    span = Span(name, root=root, **attrs)
+    parent.children.append(span)
+    return span
+
+
+@contextmanager
+def trace_span(name: str, **attrs):
+    """Контекстный менеджер для спана внутри текущего апдейта."""
+    span = start_span(name, **attrs)
+    if span is None:
+        yield None
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        span.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace_root(name: str, max_spans: int = 500, **attrs):
+    """Открывает корневой спан апдейта, все спаны внутри (не больше max_spans) станут его потомками."""
+    root = Span(name, **attrs)
+    root.budget = max_spans
+    token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+async def untraced(coro):
+    """
+        Выполняет корутину вне трассировки апдейта. Задача копирует контекст создавшего ее
+        хендлера, и без этого ее спаны копились бы в уже завершенном дереве апдейта.
+    """
+    _current_span.set(None)
+    return await coro
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Спан каждого вызова Bot API."""
+    async def __call__(self, make_request, bot, method):
+        with trace_span(f"api.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+def instrument_engine(engine) -> None:
+    """Подписывается на события движка SQLAlchemy и пишет спан на каждый запрос."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = start_span("sql", statement=" ".join(statement.split())[:200])
+        if span is not None:
+            conn.info.setdefault("trace_spans", []).append(span)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            spans.pop().end = time.perf_counter()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("trace_spans") if conn is not None else None
+        if spans:
+            span = spans.pop()
+            span.attrs["error"] = type(exception_context.original_exception).__name__
+            span.end = time.perf_counter()